@@ -4,19 +4,34 @@ VIZNX <BASE APP> SQS Lambda Consumer
 AWS Lambda function handler for processing <BASE APP> requests from SQS.
 """
 
-import json
 import os
 import logging
 import time
+import select
 import signal
+import socket
 import sys
-from typing import Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple, Union
 
-import boto3
-from botocore.exceptions import ClientError
+import orjson
 
+logger = logging.getLogger(__name__)
 
-def process_sqs_message(message_body: str, cb_datamap: Dict[str, str]) -> None:
+
+class MalformedMessageError(ValueError):
+    """The message body is unparseable or has no 'data' field, so retrying cannot succeed"""
+
+
+# Quoted key markers used to reject payloads without a 'data' key before parsing; a body with
+# a backslash may spell the key with escapes (e.g. "\u0064ata"), so it always goes to the parser
+_DATA_KEY_STR = '"data"'
+_DATA_KEY_BYTES = b'"data"'
+
+
+def process_sqs_message(message_body: Union[str, bytes, bytearray], cb_datamap: Mapping[str, Optional[str]]) -> None:
     """
     Process a single SQS message
 
@@ -34,25 +49,36 @@ def process_sqs_message(message_body: str, cb_datamap: Dict[str, str]) -> None:
             }
         }
 
-    :param message_body: The SQS message body (JSON string)
-    :param cb_datamap: A dict with the env data
+    :param message_body: The SQS message body (JSON string, bytes or bytearray)
+    :param cb_datamap: A read-only mapping with the env data
     """
-    # Load the message to a dict
+    # Cheap substring scan so bodies that cannot contain a 'data' key skip the parse
+    if isinstance(message_body, (bytes, bytearray)):
+        may_have_data_key = _DATA_KEY_BYTES in message_body or b'\\' in message_body
+    else:
+        may_have_data_key = _DATA_KEY_STR in message_body or '\\' in message_body
+    if not may_have_data_key:
+        raise MalformedMessageError("Message missing 'data' field")
+
+    # Load the message to a dict; orjson reads str and bytes natively, so neither is re-encoded
     try:
-        message_data = json.loads(message_body)
-        logging.debug("[MESSAGE] %s", str(message_data))
+        message_data = orjson.loads(message_body)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[MESSAGE] %s", message_data)
+    except orjson.JSONDecodeError as ex:
+        raise MalformedMessageError(f"[Data Load Error] [{str(ex)}]") from ex
     except Exception as ex:
         raise Exception(f"[Data Load Error] [{str(ex)}]") from ex
 
     # Extract the data field which contains the user information
     if 'data' not in message_data:
-        raise ValueError("Message missing 'data' field")
+        raise MalformedMessageError("Message missing 'data' field")
 
 
-# Setup a datamap for passing to callback
-datamap = {
+# Setup a datamap for passing to callback; read-only so callees can share it without copying
+datamap = MappingProxyType({
     "LOG_LEVEL": os.environ.get('LOG_LEVEL')
-}
+})
 
 # set the logging output
 log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
@@ -63,6 +89,38 @@ logging.getLogger("botocore").setLevel(logging.INFO)
 logging.getLogger("urllib3").setLevel(logging.INFO)
 
 
+# Shared across warm invocations; 10 workers matches the default SQS batch size, larger batches queue on the pool
+_EXECUTOR = ThreadPoolExecutor(max_workers=10)
+
+
+def _process_record(record: Dict[str, Any]) -> Optional[str]:
+    """
+    Process one Lambda SQS record, logging the outcome
+
+    :param record: SQS record from the Lambda event
+    :return: None on success, otherwise the error text for the response
+    """
+    message_id = record.get('messageId', 'unknown')
+    message_body = record.get('body')
+
+    # Extract message body from SQS record
+    if message_body is None:
+        logger.error("Record missing 'body' field: %s", record)
+        return f"Record missing 'body' field: {message_id}"
+
+    logger.info("Processing message: %s", message_id)
+
+    # Only the processing call can raise; everything around it is branch checks
+    try:
+        process_sqs_message(message_body, datamap)
+    except Exception as ex:
+        logger.error("Error processing record: %s", str(ex), exc_info=True)
+        return f"Error processing message {message_id}: {str(ex)}"
+
+    logger.info("Successfully processed message: %s", message_id)
+    return None
+
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     AWS Lambda handler function for processing SQS events
@@ -71,10 +129,8 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     :param context: Lambda context object
     :return: Response dictionary with status and results
     """
-    logger = logging.getLogger(__name__)
-
     # Initialize response
-    response = {
+    response: Dict[str, Any] = {
         'statusCode': 200,
         'processed': 0,
         'failed': 0,
@@ -88,30 +144,28 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         response['errors'].append("No 'Records' found in event")
         return response
 
-    for record in event['Records']:
-        try:
-            # Extract message body from SQS record
-            if 'body' not in record:
-                logger.error("Record missing 'body' field: %s", record)
-                response['failed'] += 1
-                response['errors'].append(f"Record missing 'body' field: {record.get('messageId', 'unknown')}")
-                continue
-
-            message_body = record['body']
-            message_id = record.get('messageId', 'unknown')
-
-            logger.info("Processing message: %s", message_id)
-
-            # Process the message
-            process_sqs_message(message_body, datamap)
-
-            response['processed'] += 1
-            logger.info("Successfully processed message: %s", message_id)
+    # Fan out to the pool only when there is more than one record to overlap
+    records = event['Records']
+    if len(records) == 1:
+        results = [_process_record(records[0])]
+    else:
+        submit = _EXECUTOR.submit
+        futures = [submit(_process_record, record) for record in records]
+        results = [future.result() for future in as_completed(futures)]
+
+    # Tally the per-record results
+    processed = 0
+    failed = 0
+
+    for error in results:
+        if error is None:
+            processed += 1
+        else:
+            failed += 1
+            response['errors'].append(error)
 
-        except Exception as ex:
-            logger.error("Error processing record: %s", str(ex), exc_info=True)
-            response['failed'] += 1
-            response['errors'].append(f"Error processing message {record.get('messageId', 'unknown')}: {str(ex)}")
+    response['processed'] = processed
+    response['failed'] = failed
 
     # Set status code based on results
     if response['failed'] > 0:
@@ -136,6 +190,9 @@ def get_sqs_client(endpoint_url: Optional[str] = None, region_name: str = 'us-ea
     :param secret_access_key: AWS secret access key
     :return: SQS client
     """
+    # boto3 is imported on first use so Lambda cold starts that never build a client skip it
+    import boto3  # pylint: disable=import-outside-toplevel
+
     session = boto3.Session(
         aws_access_key_id=access_key_id,
         aws_secret_access_key=secret_access_key
@@ -149,6 +206,33 @@ def get_sqs_client(endpoint_url: Optional[str] = None, region_name: str = 'us-ea
     return session.client('sqs', region_name=region_name)
 
 
+# Lazily created client for Lambda warm invocations (avoids global statement; name is constant).
+# Records run on _EXECUTOR, and concurrent client creation from boto3's default session is unsafe.
+_SQS_CLIENT: List[Any] = [None]
+_SQS_CLIENT_LOCK = threading.Lock()
+
+
+def _get_cached_sqs_client():
+    """
+    Return a module-level SQS client for use inside Lambda, creating it on first use
+
+    Credentials come from the Lambda execution role and the region from AWS_REGION.
+    The local main() loop keeps using get_sqs_client.
+
+    :return: SQS client
+    """
+    client = _SQS_CLIENT[0]
+    if client is None:
+        with _SQS_CLIENT_LOCK:
+            # Re-read under the lock; another thread may have created it while we waited
+            client = _SQS_CLIENT[0]
+            if client is None:
+                import boto3  # pylint: disable=import-outside-toplevel
+                client = boto3.client('sqs', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+                _SQS_CLIENT[0] = client
+    return client
+
+
 def get_queue_url(sqs_client, queue_name: str) -> Optional[str]:
     """
     Get queue URL from queue name
@@ -157,29 +241,167 @@ def get_queue_url(sqs_client, queue_name: str) -> Optional[str]:
     :param queue_name: Name of the queue
     :return: Queue URL or None if not found
     """
+    # botocore is already loaded by the time a client exists, so this import is a dict lookup
+    from botocore.exceptions import ClientError  # pylint: disable=import-outside-toplevel
+
     try:
         response = sqs_client.get_queue_url(QueueName=queue_name)
         return response['QueueUrl']
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', '')
         if error_code == 'AWS.SimpleQueueService.NonExistentQueue':
-            logging.error("Queue '%s' does not exist. Please create it in LocalStack first.", queue_name)
+            logger.error("Queue '%s' does not exist. Please create it in LocalStack first.", queue_name)
         else:
-            logging.error("Error getting queue URL: %s", e)
+            logger.error("Error getting queue URL: %s", e)
         return None
     except Exception as e:
-        logging.error("Error getting queue URL: %s", e)
+        logger.error("Error getting queue URL: %s", e)
         return None
 
 
-# Mutable container for graceful shutdown (avoids global statement; name is constant)
-SHUTDOWN_REQUESTED = [False]
+def delete_messages(sqs_client, queue_url: str, entries: List[Dict[str, str]]) -> int:
+    """
+    Delete received messages with a single DeleteMessageBatch call
+
+    :param sqs_client: SQS client
+    :param queue_url: URL of the queue the messages were received from
+    :param entries: Up to 10 dicts with 'Id' and 'ReceiptHandle' keys
+    :return: Number of messages deleted
+    """
+    if not entries:
+        return 0
+
+    try:
+        response = sqs_client.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+    except Exception as e:
+        logger.error("Error deleting message batch: %s", e)
+        return 0
+
+    # Failed entries become visible again after the visibility timeout and are retried then
+    for failure in response.get('Failed', []):
+        logger.error("Failed to delete message %s: %s %s",
+                     failure.get('Id'), failure.get('Code'), failure.get('Message', ''))
+
+    return len(response.get('Successful', []))
+
+
+def _is_malformed_message(ex: Exception) -> bool:
+    """
+    Whether a process_sqs_message error comes from the payload itself, so a retry cannot succeed
+
+    The type is checked rather than __cause__, which mypyc-compiled code does not set.
+
+    :param ex: Exception raised by process_sqs_message
+    :return: True for a MalformedMessageError (unparseable JSON or a missing 'data' field)
+    """
+    return isinstance(ex, MalformedMessageError)
+
+
+# Receive sizing: SQS caps a receive at 10 messages and VisibilityTimeout at 12 hours;
+# the EWMA weights the newest sample by 0.1
+MAX_RECEIVE_MESSAGES = 10
+MAX_VISIBILITY_TIMEOUT = 43200
+PROC_TIME_EWMA_WEIGHT = 0.1
+VISIBILITY_SAFETY_FACTOR = 2.0
+
+
+def receive_batch_size(avg_proc_ms: Optional[float], target_window_ms: float) -> int:
+    """
+    Size the next receive so the batch takes about target_window_ms to process
+
+    :param avg_proc_ms: Moving average of per-message processing time, None until measured
+    :param target_window_ms: Processing time a single receive batch should represent
+    :return: Number of messages to request, between 1 and MAX_RECEIVE_MESSAGES
+    """
+    if not avg_proc_ms:
+        return MAX_RECEIVE_MESSAGES
+    return max(1, min(MAX_RECEIVE_MESSAGES, int(target_window_ms / avg_proc_ms)))
+
+
+def receive_visibility_timeout(avg_proc_ms: Optional[float], batch_size: int, minimum: int) -> int:
+    """
+    Visibility timeout long enough for a batch of batch_size to finish processing
+
+    :param avg_proc_ms: Moving average of per-message processing time, None until measured
+    :param batch_size: Number of messages that will be requested
+    :param minimum: Configured visibility timeout in seconds, used as the floor
+    :return: Visibility timeout in seconds, at most MAX_VISIBILITY_TIMEOUT
+    """
+    if not avg_proc_ms:
+        return min(MAX_VISIBILITY_TIMEOUT, minimum)
+    timeout = max(minimum, int(avg_proc_ms * batch_size / 1000 * VISIBILITY_SAFETY_FACTOR))
+    return min(MAX_VISIBILITY_TIMEOUT, timeout)
+
+
+def _process_polled_message(index: int, message: Dict[str, Any],
+                            avg_proc_ms: Optional[float]) -> Tuple[bool, Optional[Dict[str, str]], Optional[float]]:
+    """
+    Process one message received by main(), timing it for receive sizing
+
+    :param index: Position of the message in its receive, used as the batch entry Id
+    :param message: Message from receive_message
+    :param avg_proc_ms: Moving average of per-message processing time, None until measured
+    :return: Whether processing succeeded, the delete entry or None to leave the message
+             for redelivery, and the updated moving average
+    """
+    message_id = message.get('MessageId', 'unknown')
+    # Batch entry Ids only need to be unique within this receive
+    entry = {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+
+    try:
+        logger.info("Processing message: %s", message_id)
+
+        # Process the message using the same function as Lambda
+        started = time.perf_counter()
+        process_sqs_message(message['Body'], datamap)
+        sample_ms = (time.perf_counter() - started) * 1000
+    except Exception as e:
+        if not _is_malformed_message(e):
+            logger.error("Error processing message %s: %s", message_id, e, exc_info=True)
+            # Note: Message will become visible again after visibility timeout
+            # This allows for retry of transient failures
+            return False, None, avg_proc_ms
+
+        logger.error("Error parsing message %s: %s", message_id, e)
+        logger.debug("Raw message body: %s", message.get('Body', ''))
+        # Delete problematic message to prevent infinite retries
+        logger.info("Queued malformed message for deletion: %s", message_id)
+        return False, entry, avg_proc_ms
+
+    logger.info("Successfully processed message: %s", message_id)
+
+    if avg_proc_ms is None:
+        return True, entry, sample_ms
+    return True, entry, avg_proc_ms + PROC_TIME_EWMA_WEIGHT * (sample_ms - avg_proc_ms)
+
+
+# Set on SIGINT/SIGTERM. The handler runs on the main thread, so the main thread must never
+# block in SHUTDOWN_REQUESTED.wait(): a signal landing while wait() holds the Event's internal
+# lock would make set() deadlock. main() sleeps on a signal wakeup socket instead.
+SHUTDOWN_REQUESTED = threading.Event()
 
 
 def signal_handler(signum, frame):
     """Handle shutdown signals gracefully"""
-    logging.info("Shutdown signal received. Finishing current operations...")
-    SHUTDOWN_REQUESTED[0] = True
+    logger.info("Shutdown signal received. Finishing current operations...")
+    SHUTDOWN_REQUESTED.set()
+
+
+def _wait_for_signal(wakeup_sock: socket.socket, timeout: float) -> None:
+    """
+    Sleep for up to timeout seconds, returning early if a signal arrives
+
+    :param wakeup_sock: Read end of the socket registered with signal.set_wakeup_fd
+    :param timeout: Maximum time to sleep in seconds
+    """
+    readable, _, _ = select.select([wakeup_sock], [], [], timeout)
+    if readable:
+        # Drain the signal bytes so the next wait blocks again
+        try:
+            while wakeup_sock.recv(512):
+                pass
+        except BlockingIOError:
+            pass
 
 
 def main():
@@ -194,9 +416,9 @@ def main():
         - SQS_ACCESS_KEY_ID: AWS access key (default: test)
         - SQS_SECRET_ACCESS_KEY: AWS secret key (default: test)
         - SQS_POLL_WAIT_TIME: Long polling wait time in seconds (default: 20)
-        - SQS_VISIBILITY_TIMEOUT: Message visibility timeout in seconds (default: 30)
+        - SQS_VISIBILITY_TIMEOUT: Minimum message visibility timeout in seconds (default: 30)
+        - SQS_TARGET_WINDOW_MS: Processing time one receive batch should cover (default: 5000)
     """
-    logger = logging.getLogger(__name__)
     logger.info("Starting local SQS consumer for <BASE APP> requests...")
     logger.info("This is for local testing only. Use lambda_handler for AWS Lambda deployment.")
 
@@ -212,6 +434,7 @@ def main():
     secret_access_key = os.environ.get('SQS_SECRET_ACCESS_KEY', 'test')
     poll_wait_time = int(os.environ.get('SQS_POLL_WAIT_TIME', '20'))
     visibility_timeout = int(os.environ.get('SQS_VISIBILITY_TIMEOUT', '30'))
+    target_window_ms = float(os.environ.get('SQS_TARGET_WINDOW_MS', '5000'))
 
     # Create SQS client
     try:
@@ -238,70 +461,65 @@ def main():
     logger.info("  Region: %s", region_name)
     logger.info("  Poll Wait Time: %d seconds", poll_wait_time)
     logger.info("  Visibility Timeout: %d seconds", visibility_timeout)
+    logger.info("  Target Batch Window: %d ms", target_window_ms)
     logger.info("Press Ctrl+C to stop...\n")
 
     processed_count = 0
     failed_count = 0
+    avg_proc_ms = None
+    backoff = 0
+
+    # Signals write a byte here, so backoff sleeps end as soon as one arrives
+    wakeup_read, wakeup_write = socket.socketpair()
+    wakeup_read.setblocking(False)
+    wakeup_write.setblocking(False)
+    signal.set_wakeup_fd(wakeup_write.fileno())
 
     # Continuously poll for messages
-    while not SHUTDOWN_REQUESTED[0]:
+    while not SHUTDOWN_REQUESTED.is_set():
         try:
+            # Size the receive from recent processing times so messages don't expire in memory
+            batch_size = receive_batch_size(avg_proc_ms, target_window_ms)
+
             # Receive messages from queue
             response = sqs_client.receive_message(
                 QueueUrl=queue_url,
-                MaxNumberOfMessages=10,
+                MaxNumberOfMessages=batch_size,
                 WaitTimeSeconds=poll_wait_time,  # Long polling
-                VisibilityTimeout=visibility_timeout
+                VisibilityTimeout=receive_visibility_timeout(avg_proc_ms, batch_size, visibility_timeout)
             )
+            backoff = 0
 
             if 'Messages' in response:
-                for message in response['Messages']:
-                    receipt_handle = message['ReceiptHandle']
-                    message_id = message.get('MessageId', 'unknown')
-
-                    try:
-                        logger.info("Processing message: %s", message_id)
-
-                        # Process the message using the same function as Lambda
-                        message_body = message['Body']
-                        process_sqs_message(message_body, datamap)
-
-                        # Delete message from queue after successful processing
-                        sqs_client.delete_message(
-                            QueueUrl=queue_url,
-                            ReceiptHandle=receipt_handle
-                        )
+                # Collect handles and delete everything handled in this receive at once
+                to_delete = []
+                to_delete_append = to_delete.append
 
+                for index, message in enumerate(response['Messages']):
+                    succeeded, entry, avg_proc_ms = _process_polled_message(index, message, avg_proc_ms)
+                    if succeeded:
                         processed_count += 1
-                        logger.info("Successfully processed and deleted message: %s", message_id)
-
-                    except json.JSONDecodeError as e:
-                        logger.error("Error parsing message %s: %s", message_id, e)
-                        logger.debug("Raw message body: %s", message.get('Body', ''))
-                        failed_count += 1
-                        # Delete problematic message to prevent infinite retries
-                        try:
-                            sqs_client.delete_message(
-                                QueueUrl=queue_url,
-                                ReceiptHandle=receipt_handle
-                            )
-                            logger.info("Deleted malformed message: %s", message_id)
-                        except Exception as delete_error:
-                            logger.error("Failed to delete malformed message: %s", delete_error)
-
-                    except Exception as e:
-                        logger.error("Error processing message %s: %s", message_id, e, exc_info=True)
+                    else:
                         failed_count += 1
-                        # Note: Message will become visible again after visibility timeout
-                        # This allows for retry of transient failures
+                    if entry is not None:
+                        to_delete_append(entry)
+
+                if to_delete:
+                    deleted = delete_messages(sqs_client, queue_url, to_delete)
+                    logger.info("Deleted %d of %d messages", deleted, len(to_delete))
 
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received. Shutting down...")
             break
         except Exception as e:
             logger.error("Error receiving messages: %s", e, exc_info=True)
-            if not SHUTDOWN_REQUESTED[0]:
-                time.sleep(5)  # Wait before retrying
+            # Exponential backoff capped at the long-poll wait; returns early on shutdown
+            backoff = min(backoff * 2 if backoff else 1, max(1, poll_wait_time))
+            _wait_for_signal(wakeup_read, backoff)
+
+    signal.set_wakeup_fd(-1)
+    wakeup_read.close()
+    wakeup_write.close()
 
     logger.info("\n%s", "=" * 80)
     logger.info("Local SQS consumer stopped")
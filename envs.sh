@@ -10,7 +10,8 @@ export SQS_REGION='us-east-1'
 export SQS_ACCESS_KEY_ID='test'
 export SQS_SECRET_ACCESS_KEY='test'
 export SQS_POLL_WAIT_TIME='20'  # Long polling wait time in seconds
-export SQS_VISIBILITY_TIMEOUT='30'  # Message visibility timeout in seconds
+export SQS_VISIBILITY_TIMEOUT='30'  # Minimum message visibility timeout in seconds
+export SQS_TARGET_WINDOW_MS='5000'  # Processing time one receive batch should cover
 
 # Logging Configuration
 export LOG_LEVEL="${LOG_LEVEL:-INFO}"
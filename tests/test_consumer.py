@@ -1,6 +1,14 @@
 """Pytest tests for consumer.py (SQS Lambda consumer)."""
 
 import json
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -19,15 +27,36 @@ class TestProcessSqsMessage:
         consumer.process_sqs_message(sample_message_body, cb_datamap)
 
     def test_invalid_json_raises(self, cb_datamap):
-        """Invalid JSON raises Exception."""
-        with pytest.raises(Exception) as exc_info:
-            consumer.process_sqs_message("not valid json", cb_datamap)
+        """Invalid JSON raises MalformedMessageError."""
+        with pytest.raises(consumer.MalformedMessageError) as exc_info:
+            consumer.process_sqs_message('{"data": not valid json', cb_datamap)
         assert "Data Load Error" in str(exc_info.value)
 
+    def test_body_without_data_key_rejected_before_parse(self, cb_datamap):
+        """Body that never mentions a 'data' key raises MalformedMessageError without parsing."""
+        with patch("consumer.orjson.loads") as mock_loads:
+            with pytest.raises(consumer.MalformedMessageError, match="missing 'data' field"):
+                consumer.process_sqs_message("not valid json", cb_datamap)
+        mock_loads.assert_not_called()
+
+    def test_escaped_data_key_accepted(self, cb_datamap):
+        """A 'data' key spelled with JSON escapes is found by the parser, not rejected early."""
+        body = '{"\\u0064ata": 1}'
+        consumer.process_sqs_message(body, cb_datamap)
+        consumer.process_sqs_message(body.encode(), cb_datamap)
+
+    def test_bytes_body_accepted(self, sample_message_body, cb_datamap):
+        """Valid JSON passed as bytes does not raise."""
+        consumer.process_sqs_message(sample_message_body.encode(), cb_datamap)
+
+    def test_bytearray_body_accepted(self, sample_message_body, cb_datamap):
+        """Valid JSON passed as bytearray does not raise."""
+        consumer.process_sqs_message(bytearray(sample_message_body.encode()), cb_datamap)
+
     def test_missing_data_field_raises(self, cb_datamap):
-        """Message without 'data' field raises ValueError."""
+        """Message without 'data' field raises MalformedMessageError."""
         body = json.dumps({"metadata": {"source": "test"}})
-        with pytest.raises(ValueError, match="missing 'data' field"):
+        with pytest.raises(consumer.MalformedMessageError, match="missing 'data' field"):
             consumer.process_sqs_message(body, cb_datamap)
 
     def test_empty_data_allowed(self, cb_datamap):
@@ -36,6 +65,33 @@ class TestProcessSqsMessage:
         consumer.process_sqs_message(body, cb_datamap)
 
 
+class TestDatamap:
+    """Tests for the module-level datamap."""
+
+    def test_module_datamap_is_read_only(self):
+        """The shared datamap cannot be mutated by callees."""
+        with pytest.raises(TypeError):
+            consumer.datamap["LOG_LEVEL"] = "DEBUG"
+
+
+class TestProcessRecord:
+    """Tests for _process_record."""
+
+    def test_success_returns_none(self, sample_sqs_record):
+        """Valid record returns no error."""
+        assert consumer._process_record(sample_sqs_record) is None
+
+    def test_missing_body_returns_error(self):
+        """Record without 'body' returns an error naming the message."""
+        error = consumer._process_record({"messageId": "m1"})
+        assert error == "Record missing 'body' field: m1"
+
+    def test_processing_error_returns_error(self):
+        """Processing failure is returned as text instead of raised."""
+        error = consumer._process_record({"messageId": "m1", "body": "invalid"})
+        assert error.startswith("Error processing message m1:")
+
+
 class TestLambdaHandler:
     """Tests for lambda_handler."""
 
@@ -121,11 +177,33 @@ class TestLambdaHandler:
         assert response["failed"] == 1
         assert len(response["errors"]) == 1
 
+    def test_bytes_body_passed_to_parser_unchanged(self, sample_message_body, mock_lambda_context):
+        """Record bodies reach the parser as-is, without a str/bytes conversion."""
+        body = sample_message_body.encode()
+        event = {"Records": [{"messageId": "m1", "body": body}]}
+        with patch("consumer.orjson.loads", return_value={"data": {}}) as mock_loads:
+            response = consumer.lambda_handler(event, mock_lambda_context)
+        assert response["processed"] == 1
+        assert mock_loads.call_args[0][0] is body
+
+    def test_multiple_records_all_counted(self, sample_message_body, mock_lambda_context):
+        """A full batch processed through the thread pool is fully aggregated."""
+        records = [{"messageId": f"m{i}", "body": sample_message_body} for i in range(8)]
+        records.append({"messageId": "bad1", "body": "invalid"})
+        records.append({"messageId": "bad2"})
+        response = consumer.lambda_handler({"Records": records}, mock_lambda_context)
+        assert response["statusCode"] == 207
+        assert response["processed"] == 8
+        assert response["failed"] == 2
+        assert len(response["errors"]) == 2
+        assert any("bad1" in e for e in response["errors"])
+        assert any("bad2" in e for e in response["errors"])
+
 
 class TestGetSqsClient:
     """Tests for get_sqs_client."""
 
-    @patch("consumer.boto3.Session")
+    @patch("boto3.Session")
     def test_with_endpoint_url_uses_endpoint(self, mock_session):
         """When endpoint_url is set, client is created with endpoint_url."""
         mock_client = MagicMock()
@@ -141,7 +219,7 @@ class TestGetSqsClient:
         )
         assert result is mock_client
 
-    @patch("consumer.boto3.Session")
+    @patch("boto3.Session")
     def test_without_endpoint_url_no_endpoint_kwarg(self, mock_session):
         """When endpoint_url is None, client is created without endpoint_url."""
         mock_client = MagicMock()
@@ -156,6 +234,54 @@ class TestGetSqsClient:
         assert result is mock_client
 
 
+class TestGetCachedSqsClient:
+    """Tests for _get_cached_sqs_client."""
+
+    @patch("boto3.client")
+    def test_client_created_once(self, mock_client, monkeypatch):
+        """Client is built on first call and reused afterwards."""
+        monkeypatch.setattr(consumer, "_SQS_CLIENT", [None])
+        monkeypatch.setenv("AWS_REGION", "eu-west-1")
+        first = consumer._get_cached_sqs_client()
+        second = consumer._get_cached_sqs_client()
+        assert first is second
+        mock_client.assert_called_once_with("sqs", region_name="eu-west-1")
+
+    @patch("boto3.client")
+    def test_concurrent_first_calls_create_one_client(self, mock_client, monkeypatch):
+        """Threads racing on the first call all get the same, single client."""
+        monkeypatch.setattr(consumer, "_SQS_CLIENT", [None])
+        start = threading.Barrier(8)
+
+        def slow_client(*args, **kwargs):
+            time.sleep(0.05)
+            return MagicMock()
+
+        def call():
+            start.wait()
+            return consumer._get_cached_sqs_client()
+
+        mock_client.side_effect = slow_client
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            clients = list(pool.map(lambda _: call(), range(8)))
+        assert mock_client.call_count == 1
+        assert all(c is clients[0] for c in clients)
+
+
+class TestLazyBoto3Import:
+    """Tests for keeping boto3 off the module import path."""
+
+    def test_consumer_import_does_not_load_boto3(self):
+        """Importing consumer in a fresh interpreter leaves boto3 unloaded."""
+        code = "import sys, consumer; sys.exit('boto3' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=Path(consumer.__file__).resolve().parent,
+            check=False,
+        )
+        assert result.returncode == 0
+
+
 class TestGetQueueUrl:
     """Tests for get_queue_url."""
 
@@ -195,14 +321,274 @@ class TestGetQueueUrl:
         assert url is None
 
 
+class TestDeleteMessages:
+    """Tests for delete_messages."""
+
+    def test_empty_entries_makes_no_call(self):
+        """No entries means no DeleteMessageBatch request."""
+        sqs_client = MagicMock()
+        assert consumer.delete_messages(sqs_client, "http://q/foo", []) == 0
+        sqs_client.delete_message_batch.assert_not_called()
+
+    def test_deletes_all_entries_in_one_call(self):
+        """All entries are sent in a single batch; returns successful count."""
+        sqs_client = MagicMock()
+        entries = [
+            {"Id": "m1", "ReceiptHandle": "r1"},
+            {"Id": "m2", "ReceiptHandle": "r2"},
+        ]
+        sqs_client.delete_message_batch.return_value = {
+            "Successful": [{"Id": "m1"}, {"Id": "m2"}],
+        }
+        deleted = consumer.delete_messages(sqs_client, "http://q/foo", entries)
+        assert deleted == 2
+        sqs_client.delete_message_batch.assert_called_once_with(
+            QueueUrl="http://q/foo", Entries=entries
+        )
+
+    def test_failed_entries_not_counted(self):
+        """Entries reported in 'Failed' are excluded from the count."""
+        sqs_client = MagicMock()
+        sqs_client.delete_message_batch.return_value = {
+            "Successful": [{"Id": "m1"}],
+            "Failed": [{"Id": "m2", "Code": "ReceiptHandleIsInvalid", "SenderFault": True}],
+        }
+        entries = [
+            {"Id": "m1", "ReceiptHandle": "r1"},
+            {"Id": "m2", "ReceiptHandle": "r2"},
+        ]
+        assert consumer.delete_messages(sqs_client, "http://q/foo", entries) == 1
+
+    def test_returns_zero_on_exception(self):
+        """On request error, returns 0."""
+        sqs_client = MagicMock()
+        sqs_client.delete_message_batch.side_effect = RuntimeError("network error")
+        entries = [{"Id": "m1", "ReceiptHandle": "r1"}]
+        assert consumer.delete_messages(sqs_client, "http://q/foo", entries) == 0
+
+
+class TestReceiveBatchSize:
+    """Tests for receive_batch_size and receive_visibility_timeout."""
+
+    def test_unmeasured_uses_max_batch(self):
+        """Before any sample, request the SQS maximum."""
+        assert consumer.receive_batch_size(None, 5000) == consumer.MAX_RECEIVE_MESSAGES
+
+    def test_fast_processing_clamped_to_max(self):
+        """Fast processing cannot exceed the SQS maximum."""
+        assert consumer.receive_batch_size(1.0, 5000) == consumer.MAX_RECEIVE_MESSAGES
+
+    def test_slow_processing_shrinks_batch(self):
+        """Batch covers roughly the target window."""
+        assert consumer.receive_batch_size(1000.0, 5000) == 5
+
+    def test_very_slow_processing_floors_at_one(self):
+        """At least one message is always requested."""
+        assert consumer.receive_batch_size(60000.0, 5000) == 1
+
+    def test_visibility_timeout_uses_minimum(self):
+        """Configured timeout is used until it is too short for the batch."""
+        assert consumer.receive_visibility_timeout(None, 10, 30) == 30
+        assert consumer.receive_visibility_timeout(100.0, 10, 30) == 30
+
+    def test_visibility_timeout_grows_with_batch(self):
+        """Slow batches get a longer timeout with the safety factor applied."""
+        assert consumer.receive_visibility_timeout(20000.0, 2, 30) == 80
+
+    def test_visibility_timeout_capped_at_sqs_maximum(self):
+        """Very slow processing or a large configured floor never exceeds the SQS limit."""
+        seven_hours_ms = 7 * 3600 * 1000.0
+        assert consumer.receive_visibility_timeout(seven_hours_ms, 1, 30) == consumer.MAX_VISIBILITY_TIMEOUT
+        assert consumer.receive_visibility_timeout(None, 10, 100000) == consumer.MAX_VISIBILITY_TIMEOUT
+
+
+class TestMain:
+    """Tests for the local polling loop in main."""
+
+    @staticmethod
+    def _receive_sequence(*responses):
+        """receive_message side effect: replay responses, then request shutdown."""
+        pending = list(responses)
+
+        def receive(**kwargs):
+            if not pending:
+                consumer.SHUTDOWN_REQUESTED.set()
+                return {}
+            item = pending.pop(0)
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+        return receive
+
+    @staticmethod
+    def _run_main(monkeypatch, receive):
+        """Run main against a mocked SQS client until receive requests shutdown."""
+        # Patch at the boto3 boundary so this also works when consumer is compiled with mypyc
+        sqs_client = MagicMock()
+        sqs_client.get_queue_url.return_value = {"QueueUrl": "http://q/foo"}
+        sqs_client.receive_message.side_effect = receive
+        sqs_client.delete_message_batch.return_value = {"Successful": []}
+        session = MagicMock()
+        session.return_value.client.return_value = sqs_client
+        monkeypatch.setenv("SQS_QUEUE_NAME", "my-queue")
+        monkeypatch.setattr("boto3.Session", session)
+        monkeypatch.setattr(consumer.signal, "signal", lambda signum, handler: None)
+        consumer.SHUTDOWN_REQUESTED.clear()
+        try:
+            consumer.main()
+        finally:
+            consumer.SHUTDOWN_REQUESTED.clear()
+        return sqs_client
+
+    def test_processed_and_malformed_deleted_in_one_batch(
+        self, monkeypatch, sample_message_body
+    ):
+        """Processed and malformed messages share one batch; indexes are the entry Ids."""
+        messages = [
+            {"MessageId": "m1", "ReceiptHandle": "r1", "Body": sample_message_body},
+            {"MessageId": "m2", "ReceiptHandle": "r2", "Body": '{"data": bad'},
+            {"MessageId": "m3", "ReceiptHandle": "r3", "Body": "nope"},
+        ]
+        sqs_client = self._run_main(
+            monkeypatch, self._receive_sequence({"Messages": messages})
+        )
+        sqs_client.delete_message_batch.assert_called_once_with(
+            QueueUrl="http://q/foo",
+            Entries=[
+                {"Id": "0", "ReceiptHandle": "r1"},
+                {"Id": "1", "ReceiptHandle": "r2"},
+                {"Id": "2", "ReceiptHandle": "r3"},
+            ],
+        )
+
+    def test_duplicate_message_ids_get_distinct_entry_ids(
+        self, monkeypatch, sample_message_body
+    ):
+        """The same message delivered twice in one receive still has unique entry Ids."""
+        messages = [
+            {"ReceiptHandle": "r1", "Body": sample_message_body},
+            {"ReceiptHandle": "r2", "Body": sample_message_body},
+        ]
+        sqs_client = self._run_main(
+            monkeypatch, self._receive_sequence({"Messages": messages})
+        )
+        entries = sqs_client.delete_message_batch.call_args[1]["Entries"]
+        assert [e["Id"] for e in entries] == ["0", "1"]
+
+    def test_receive_sized_from_processing_time(
+        self, monkeypatch, sample_message_body
+    ):
+        """After a 2s sample, the next receive asks for fewer messages and a longer timeout."""
+        monkeypatch.setenv("SQS_VISIBILITY_TIMEOUT", "1")
+        monkeypatch.setenv("SQS_TARGET_WINDOW_MS", "5000")
+        monkeypatch.setattr(consumer.time, "perf_counter", MagicMock(side_effect=[10.0, 12.0]))
+        messages = [{"MessageId": "m1", "ReceiptHandle": "r1", "Body": sample_message_body}]
+        sqs_client = self._run_main(
+            monkeypatch, self._receive_sequence({"Messages": messages})
+        )
+        first, second = [c[1] for c in sqs_client.receive_message.call_args_list]
+        assert first["MaxNumberOfMessages"] == consumer.MAX_RECEIVE_MESSAGES
+        assert first["VisibilityTimeout"] == 1
+        # 5000ms window / 2000ms per message; 2000ms * 2 messages * 2.0 safety
+        assert second["MaxNumberOfMessages"] == 2
+        assert second["VisibilityTimeout"] == 8
+
+    def test_receive_errors_back_off_exponentially(self, monkeypatch):
+        """Backoff doubles up to the poll wait time and resets after a successful receive."""
+        monkeypatch.setenv("SQS_POLL_WAIT_TIME", "3")
+        fake_select = MagicMock(return_value=([], [], []))
+        monkeypatch.setattr(consumer.select, "select", fake_select)
+        error = RuntimeError("network error")
+        self._run_main(
+            monkeypatch, self._receive_sequence(error, error, error, {}, error)
+        )
+        assert [c[0][3] for c in fake_select.call_args_list] == [1, 2, 3, 1]
+
+    def test_shutdown_during_backoff_exits_loop(self, monkeypatch):
+        """A shutdown signal while backing off ends the loop without another receive."""
+        def fake_select(readers, writers, errors, timeout):
+            if timeout == 2:
+                consumer.signal_handler(signal.SIGTERM, None)
+                return readers, [], []
+            return [], [], []
+
+        select_mock = MagicMock(side_effect=fake_select)
+        monkeypatch.setattr(consumer.select, "select", select_mock)
+        monkeypatch.setattr(consumer.SHUTDOWN_REQUESTED, "wait", MagicMock())
+        sqs_client = self._run_main(
+            monkeypatch, MagicMock(side_effect=RuntimeError("network error"))
+        )
+        assert [c[0][3] for c in select_mock.call_args_list] == [1, 2]
+        assert sqs_client.receive_message.call_count == 2
+        # The main thread must not block on the Event the signal handler sets
+        consumer.SHUTDOWN_REQUESTED.wait.assert_not_called()
+
+    def test_wakeup_fd_restored_on_exit(self, monkeypatch):
+        """main() unregisters its signal wakeup socket when it stops."""
+        self._run_main(monkeypatch, self._receive_sequence())
+        assert signal.set_wakeup_fd(-1) == -1
+
+    def test_plain_value_error_not_deleted(self, monkeypatch):
+        """A ValueError that is not a MalformedMessageError leaves the message for redelivery."""
+        parsed = MagicMock()
+        parsed.__contains__.side_effect = ValueError("downstream")
+        monkeypatch.setattr(consumer.orjson, "loads", MagicMock(return_value=parsed))
+        messages = [{"MessageId": "m1", "ReceiptHandle": "r1", "Body": '{"data": {}}'}]
+        sqs_client = self._run_main(
+            monkeypatch, self._receive_sequence({"Messages": messages})
+        )
+        sqs_client.delete_message_batch.assert_not_called()
+
+    def test_transient_error_not_deleted(self, monkeypatch, sample_message_body):
+        """Unexpected processing errors leave the message for redelivery."""
+        messages = [{"MessageId": "m1", "ReceiptHandle": "r1", "Body": sample_message_body}]
+        monkeypatch.setattr(consumer.orjson, "loads", MagicMock(side_effect=RuntimeError("downstream")))
+        sqs_client = self._run_main(
+            monkeypatch, self._receive_sequence({"Messages": messages})
+        )
+        sqs_client.delete_message_batch.assert_not_called()
+
+
+class TestWaitForSignal:
+    """Tests for _wait_for_signal."""
+
+    def test_returns_early_when_signal_byte_written(self):
+        """A byte on the wakeup socket ends the sleep and is drained."""
+        read_sock, write_sock = socket.socketpair()
+        read_sock.setblocking(False)
+        try:
+            write_sock.send(b"\x0f")
+            started = time.monotonic()
+            consumer._wait_for_signal(read_sock, 5)
+            assert time.monotonic() - started < 1
+            with pytest.raises(BlockingIOError):
+                read_sock.recv(1)
+        finally:
+            read_sock.close()
+            write_sock.close()
+
+    def test_sleeps_until_timeout_without_signal(self):
+        """Without a signal the full timeout elapses."""
+        read_sock, write_sock = socket.socketpair()
+        read_sock.setblocking(False)
+        try:
+            started = time.monotonic()
+            consumer._wait_for_signal(read_sock, 0.05)
+            assert time.monotonic() - started >= 0.05
+        finally:
+            read_sock.close()
+            write_sock.close()
+
+
 class TestSignalHandler:
     """Tests for signal_handler."""
 
     def test_sets_shutdown_requested(self):
-        """signal_handler sets SHUTDOWN_REQUESTED[0] to True."""
-        consumer.SHUTDOWN_REQUESTED[0] = False
+        """signal_handler sets the SHUTDOWN_REQUESTED event."""
+        consumer.SHUTDOWN_REQUESTED.clear()
         try:
             consumer.signal_handler(None, None)
-            assert consumer.SHUTDOWN_REQUESTED[0] is True
+            assert consumer.SHUTDOWN_REQUESTED.is_set()
         finally:
-            consumer.SHUTDOWN_REQUESTED[0] = False
+            consumer.SHUTDOWN_REQUESTED.clear()